@@ -0,0 +1,156 @@
+"""Cross-file batching of the Whisper encoder
+
+When several transcriptions run at once on a GPU, a single 30-second window
+(batch size 1) leaves the encoder mostly idle. The worker below collects
+windows from concurrently submitted files, encodes them in one forward pass,
+decodes them as a batch and hands each file its own segments back.
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+import whisper
+from whisper.audio import CHUNK_LENGTH, N_SAMPLES, SAMPLE_RATE
+
+# Seconds per timestamp token
+TIME_PRECISION = 0.02
+
+
+class BatchingWhisperWorker:
+    """Background thread batching fixed 30-second Whisper windows across files
+
+    Unlike ``model.transcribe``, windows are not re-aligned to the last
+    decoded timestamp, so a word straddling a window boundary may be split.
+    """
+
+    def __init__(self, model, max_batch_size: int = 16, max_wait_ms: int = 50):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.tokenizer = whisper.tokenizer.get_tokenizer(
+            model.is_multilingual, num_languages=model.num_languages, task="transcribe"
+        )
+        self._requests: "queue.Queue[Optional[Tuple[np.ndarray, Optional[str], Future]]]" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, audio: np.ndarray, language: Optional[str] = None) -> Future:
+        """Queue 16kHz mono audio; the future resolves to a Whisper-style result dict"""
+        future = Future()
+        self._requests.put((audio, language, future))
+        return future
+
+    def close(self):
+        """Stop the worker thread once queued requests are processed"""
+        self._requests.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            request = self._requests.get()
+            if request is None:
+                return
+
+            # Wait briefly for other files so their windows share the batch
+            batch = [request]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self._requests.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if request is None:
+                    self._requests.put(None)
+                    break
+                batch.append(request)
+
+            try:
+                results = self._transcribe_batch([(audio, language) for audio, language, _ in batch])
+                for (_, _, future), result in zip(batch, results):
+                    future.set_result(result)
+            except Exception as e:
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    @torch.inference_mode()
+    def _transcribe_batch(self, requests: List[Tuple[np.ndarray, Optional[str]]]) -> List[Dict]:
+        """Encode and decode every 30-second window of every file in shared batches"""
+        windows = []  # (request index, window offset in seconds, window end, mel)
+        for index, (audio, _) in enumerate(requests):
+            duration = len(audio) / SAMPLE_RATE
+            for start in range(0, max(len(audio), 1), N_SAMPLES):
+                chunk = whisper.pad_or_trim(audio[start:start + N_SAMPLES])
+                mel = whisper.log_mel_spectrogram(chunk, self.model.dims.n_mels)
+                offset = start / SAMPLE_RATE
+                windows.append((index, offset, min(offset + CHUNK_LENGTH, duration), mel))
+
+        results = [{"text": "", "segments": [], "language": language} for _, language in requests]
+        fp16 = self.model.device.type == "cuda"
+        dtype = torch.float16 if fp16 else torch.float32
+
+        for i in range(0, len(windows), self.max_batch_size):
+            group = windows[i:i + self.max_batch_size]
+            mels = torch.stack([mel for _, _, _, mel in group]).to(self.model.device, dtype)
+
+            features = self.model.encoder(mels)
+
+            # Decode per language so that forced languages are respected
+            by_language: Dict[Optional[str], List[int]] = {}
+            for j, (index, _, _, _) in enumerate(group):
+                by_language.setdefault(requests[index][1], []).append(j)
+
+            for language, rows in by_language.items():
+                options = whisper.DecodingOptions(language=language, fp16=fp16)
+                decoded = whisper.decode(self.model, features[rows], options)
+                for j, decoding in zip(rows, decoded):
+                    index, offset, window_end, _ = group[j]
+                    result = results[index]
+                    if result["language"] is None:
+                        result["language"] = decoding.language
+                    result["segments"].extend(
+                        self._window_segments(decoding.tokens, offset, window_end)
+                    )
+
+        for result in results:
+            result["text"] = "".join(segment["text"] for segment in result["segments"])
+        return results
+
+    def _window_segments(self, tokens: List[int], offset: float, window_end: float) -> List[Dict]:
+        """Split a decoded window into segments using its timestamp tokens"""
+        timestamp_begin = self.tokenizer.timestamp_begin
+        segments = []
+        start = None
+        text_tokens = []
+
+        for token in tokens:
+            if token >= timestamp_begin:
+                time_s = offset + (token - timestamp_begin) * TIME_PRECISION
+                if start is not None and text_tokens:
+                    segments.append({
+                        "start": start,
+                        "end": min(time_s, window_end),
+                        "text": self.tokenizer.decode(text_tokens)
+                    })
+                    start, text_tokens = None, []
+                else:
+                    start = time_s
+            else:
+                text_tokens.append(token)
+
+        # Trailing text without a closing timestamp runs to the end of the window
+        if text_tokens:
+            segments.append({
+                "start": start if start is not None else offset,
+                "end": window_end,
+                "text": self.tokenizer.decode(text_tokens)
+            })
+        return segments
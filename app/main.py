@@ -1,19 +1,29 @@
 import os
 import uuid
 import asyncio
+import functools
+import multiprocessing
 import aiofiles
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
-from typing import Dict, Optional
+from typing import Iterable, Optional, Tuple
 from pathlib import Path
 
-from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks, Form
-from fastapi.responses import HTMLResponse, JSONResponse, FileResponse
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form
+from fastapi.responses import HTMLResponse, ORJSONResponse, FileResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-import magic
 
 from app.models import TranscriptionRequest, TaskStatus
-from app.transcribe import transcriber
+from app.transcribe import (
+    transcriber,
+    run_transcription,
+    cuda_available,
+    batching_enabled,
+    export_shared_whisper_model
+)
+from app.task_store import create_task_store
 from app.exceptions import (
     FileValidationError,
     UnsupportedFormatError,
@@ -26,65 +36,170 @@ from app.exceptions import (
 app = FastAPI(
     title="AudioToText",
     description="Convert audio to text with speaker detection",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # Mount static files and templates
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
 templates = Jinja2Templates(directory="templates")
 
-# Global task storage (in production, use Redis or database)
-active_tasks: Dict[str, TaskStatus] = {}
+# Task status storage (Redis when REDIS_URL is set, in-memory otherwise)
+task_store = create_task_store(os.getenv("REDIS_URL"))
 
 # Configuration
 UPLOAD_DIR = Path("uploads")
 OUTPUT_DIR = Path("outputs")
 MAX_FILE_SIZE = 100 * 1024 * 1024  # 100MB
-SUPPORTED_FORMATS = ['.mp3', '.wav', '.m4a', '.flac', '.ogg', '.webm']
+UPLOAD_CHUNK_SIZE = 64 * 1024  # 64KB streaming buffer
+OUTPUT_WRITE_SIZE = 64 * 1024  # Flush formatted output to disk in ~64KB writes
+SNIFF_SIZE = 16  # Header bytes needed to recognize supported audio formats
+SUPPORTED_FORMATS = frozenset({'.mp3', '.wav', '.m4a', '.flac', '.ogg', '.webm'})
+TASK_TTL = 86400  # Remove tasks older than 24 hours
+MAX_CONCURRENT_TRANSCRIPTIONS = int(os.getenv("MAX_CONCURRENT_TRANSCRIPTIONS", "2"))
+MAX_QUEUED_TRANSCRIPTIONS = int(os.getenv("MAX_QUEUED_TRANSCRIPTIONS", "100"))
+DEFAULT_MODEL_SIZE = "base"
+
+# Uploaded files waiting for transcription, drained by MAX_CONCURRENT_TRANSCRIPTIONS
+# workers; the bound rejects new uploads instead of piling up files on disk
+transcription_queue: asyncio.Queue = asyncio.Queue(maxsize=MAX_QUEUED_TRANSCRIPTIONS)
+
+# Executor running Whisper/pyannote outside the event loop (created at startup)
+transcription_pool: Optional[Executor] = None
+
+# Long-running asyncio tasks started at startup (referenced so they are not garbage collected)
+background_workers = set()
 
 # Ensure directories exist
 UPLOAD_DIR.mkdir(exist_ok=True)
 OUTPUT_DIR.mkdir(exist_ok=True)
 
 
-def validate_audio_file(file: UploadFile) -> bool:
-    """Validate uploaded file is a supported audio format"""
+def _is_wav(head: bytes) -> bool:
+    return head.startswith(b"RIFF") and head[8:12] == b"WAVE"
+
+
+def _is_mp3(head: bytes) -> bool:
+    return head.startswith(b"ID3") or (len(head) > 1 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0)
+
+
+def _is_flac(head: bytes) -> bool:
+    return head.startswith(b"fLaC")
+
+
+def _is_ogg(head: bytes) -> bool:
+    return head.startswith(b"OggS")
+
+
+def _is_m4a(head: bytes) -> bool:
+    return head[4:8] == b"ftyp"
+
+
+def _is_webm(head: bytes) -> bool:
+    return head.startswith(b"\x1aE\xdf\xa3")
+
+
+# Dispatch on the first header byte: at most one signature comparison per upload
+SNIFF_TABLE = {
+    0x52: ('.wav', _is_wav),    # "R" of RIFF
+    0x49: ('.mp3', _is_mp3),    # "I" of ID3
+    0xFF: ('.mp3', _is_mp3),    # MPEG frame sync
+    0x66: ('.flac', _is_flac),  # "f" of fLaC
+    0x4F: ('.ogg', _is_ogg),    # "O" of OggS
+    0x1A: ('.webm', _is_webm),  # EBML header
+}
+
+
+def _sniff_audio(head: bytes) -> Optional[str]:
+    """Identify a supported audio container from its leading magic bytes"""
+    if not head:
+        return None
+
+    entry = SNIFF_TABLE.get(head[0])
+    if entry is not None and entry[1](head):
+        return entry[0]
+
+    # MP4/M4A files start with a variable box size; the ftyp marker sits at offset 4
+    if _is_m4a(head):
+        return '.m4a'
+    return None
+
+
+def validate_audio_file(file: UploadFile) -> Tuple[bool, str]:
+    """Validate uploaded file is a supported audio format
+
+    Returns whether the file is valid along with its lowercased extension,
+    so callers do not need to parse the filename again.
+    """
     # Check file extension
     file_ext = Path(file.filename).suffix.lower()
     if file_ext not in SUPPORTED_FORMATS:
-        return False
+        return False, file_ext
 
-    # Check MIME type if possible
+    # Check the container signature if possible
     try:
-        file_content = file.file.read(1024)
+        head = file.file.read(SNIFF_SIZE)
         file.file.seek(0)
-        mime_type = magic.from_buffer(file_content, mime=True)
+    except Exception:
+        # If the header cannot be read, trust the file extension
+        return True, file_ext
 
-        allowed_mimes = [
-            'audio/mpeg', 'audio/wav', 'audio/x-wav',
-            'audio/mp4', 'audio/m4a', 'audio/flac',
-            'audio/ogg', 'audio/webm'
-        ]
-        return mime_type in allowed_mimes
-    except:
-        # If mime detection fails, trust the file extension
-        return True
+    # Mislabelled but still supported containers are accepted as well
+    return _sniff_audio(head) is not None, file_ext
 
 
-async def save_upload_file(upload_file: UploadFile) -> str:
-    """Save uploaded file to disk"""
+async def save_upload_file(upload_file: UploadFile, file_ext: str, max_size: int = MAX_FILE_SIZE) -> str:
+    """Stream uploaded file to disk, enforcing the size limit as bytes arrive"""
     file_id = str(uuid.uuid4())
-    file_ext = Path(upload_file.filename).suffix.lower()
     filename = f"{file_id}{file_ext}"
     file_path = UPLOAD_DIR / filename
 
-    async with aiofiles.open(file_path, 'wb') as f:
-        content = await upload_file.read()
-        await f.write(content)
+    total = 0
+    try:
+        async with aiofiles.open(file_path, 'wb') as f:
+            while chunk := await upload_file.read(UPLOAD_CHUNK_SIZE):
+                total += len(chunk)
+                if total > max_size:
+                    raise FileSizeError(
+                        f"File size exceeds {max_size // (1024*1024)}MB limit"
+                    )
+                await f.write(chunk)
+    except Exception:
+        # Never leave a partial upload behind
+        cleanup_file(str(file_path))
+        raise
 
     return str(file_path)
 
 
+async def write_output_file(output_path: Path, chunks: Iterable[str]):
+    """Write formatted output incrementally, batching small chunks into larger writes
+
+    The file is written next to its destination and atomically renamed into
+    place once complete, so readers never see a partially written result.
+    """
+    tmp_path = output_path.with_suffix(output_path.suffix + '.tmp')
+    try:
+        async with aiofiles.open(tmp_path, 'w', encoding='utf-8') as f:
+            buffer = []
+            buffered = 0
+            for chunk in chunks:
+                buffer.append(chunk)
+                buffered += len(chunk)
+                if buffered >= OUTPUT_WRITE_SIZE:
+                    await f.write("".join(buffer))
+                    buffer.clear()
+                    buffered = 0
+            if buffer:
+                await f.write("".join(buffer))
+            await f.flush()
+            await asyncio.get_event_loop().run_in_executor(None, os.fsync, f.fileno())
+        os.replace(tmp_path, output_path)
+    except Exception:
+        cleanup_file(str(tmp_path))
+        raise
+
+
 def cleanup_file(file_path: str):
     """Clean up temporary files"""
     try:
@@ -95,41 +210,74 @@ def cleanup_file(file_path: str):
 
 
 async def process_transcription_task(task_id: str, file_path: str, request: TranscriptionRequest):
-    """Background task for processing transcription"""
+    """Process one queued transcription"""
     try:
+        # The store ignores updates to missing tasks, so a task deleted while
+        # queued has to be caught here or it would still be transcribed
+        if await task_store.get(task_id) is None:
+            print(f"Task {task_id} was deleted before processing, skipping")
+            return
+
         # Update task status to processing
-        active_tasks[task_id].status = "processing"
-        active_tasks[task_id].progress = 0.1
-        active_tasks[task_id].message = "Loading transcription model..."
-
-        # Perform transcription
-        result = transcriber.transcribe_audio(
-            file_path=file_path,
-            detect_speakers=request.detect_speakers,
-            model_size=request.model_size,
-            language=request.language,
-            task_id=task_id
+        await task_store.update(
+            task_id,
+            status="processing",
+            progress=0.1,
+            message="Loading transcription model..."
         )
 
-        # Update task status with result
-        active_tasks[task_id].status = "completed"
-        active_tasks[task_id].progress = 1.0
-        active_tasks[task_id].message = "Transcription completed"
-        active_tasks[task_id].result = result
-
-        # Save results in all formats
-        for format_type in ["json", "txt", "srt"]:
-            output_path = OUTPUT_DIR / f"{task_id}.{format_type}"
-            formatted_output = transcriber.format_output(result, format_type)
-
-            async with aiofiles.open(output_path, 'w', encoding='utf-8') as f:
-                await f.write(formatted_output)
+        # Perform transcription in a worker process so the event loop stays responsive
+        loop = asyncio.get_running_loop()
+        pool = transcription_pool
+        try:
+            result = await loop.run_in_executor(
+                pool,
+                functools.partial(
+                    run_transcription,
+                    file_path=file_path,
+                    detect_speakers=request.detect_speakers,
+                    model_size=request.model_size,
+                    language=request.language,
+                    task_id=task_id
+                )
+            )
+        except BrokenProcessPool:
+            # A worker died (OOM kill, CUDA abort); the pool is unusable from now on
+            reset_transcription_pool(pool)
+            raise Exception("Transcription worker process crashed")
+
+        if await task_store.get(task_id) is None:
+            print(f"Task {task_id} was deleted during transcription, discarding the result")
+            return
+
+        # Save results in all formats (results live on disk, not in the task store)
+        output_paths = [OUTPUT_DIR / f"{task_id}.{format_type}" for format_type in ["json", "txt", "srt"]]
+        for output_path in output_paths:
+            await write_output_file(output_path, transcriber.format_output_iter(result, output_path.suffix[1:]))
+
+        # Without a store entry the TTL sweep would never remove these files
+        if await task_store.get(task_id) is None:
+            print(f"Task {task_id} was deleted while saving results, removing them")
+            for output_path in output_paths:
+                cleanup_file(str(output_path))
+            return
+
+        # Update task status once the results are available
+        await task_store.update(
+            task_id,
+            status="completed",
+            progress=1.0,
+            message="Transcription completed"
+        )
 
     except Exception as e:
         # Update task status with error
-        active_tasks[task_id].status = "failed"
-        active_tasks[task_id].error = str(e)
-        active_tasks[task_id].message = f"Transcription failed: {str(e)}"
+        await task_store.update(
+            task_id,
+            status="failed",
+            error=str(e),
+            message=f"Transcription failed: {str(e)}"
+        )
         print(f"Error in transcription task {task_id}: {e}")
         import traceback
         traceback.print_exc()
@@ -139,6 +287,47 @@ async def process_transcription_task(task_id: str, file_path: str, request: Tran
         cleanup_file(file_path)
 
 
+def transcription_slots() -> int:
+    """Number of transcriptions that actually run at once"""
+    if batching_enabled():
+        return MAX_CONCURRENT_TRANSCRIPTIONS
+    # A single GPU worker serializes VRAM access; on CPU run one worker per slot
+    return 1 if cuda_available() else MAX_CONCURRENT_TRANSCRIPTIONS
+
+
+def create_transcription_pool() -> Executor:
+    """Create the executor running transcriptions"""
+    if batching_enabled():
+        # Concurrent transcriptions share one process so their Whisper windows can be batched
+        return ThreadPoolExecutor(max_workers=transcription_slots())
+
+    # Use 'spawn' since CUDA cannot be re-initialized in forked processes
+    return ProcessPoolExecutor(
+        max_workers=transcription_slots(),
+        mp_context=multiprocessing.get_context("spawn")
+    )
+
+
+def reset_transcription_pool(broken: Executor):
+    """Replace a broken process pool, once even if several tasks saw it fail"""
+    global transcription_pool
+    if transcription_pool is not broken:
+        return
+    print("Transcription worker process died, restarting the worker pool")
+    broken.shutdown(wait=False)
+    transcription_pool = create_transcription_pool()
+
+
+async def transcription_worker():
+    """Drain the transcription queue, one task at a time"""
+    while True:
+        task_id, file_path, request = await transcription_queue.get()
+        try:
+            await process_transcription_task(task_id, file_path, request)
+        finally:
+            transcription_queue.task_done()
+
+
 @app.get("/", response_class=HTMLResponse)
 async def root():
     """Serve the main web interface"""
@@ -147,7 +336,6 @@ async def root():
 
 @app.post("/upload")
 async def upload_file(
-    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     detect_speakers: bool = Form(True),
     model_size: str = Form("base"),
@@ -156,20 +344,17 @@ async def upload_file(
 ):
     """Upload and process audio file"""
 
-    # Validate file size
-    if hasattr(file, 'size') and file.size > MAX_FILE_SIZE:
-        raise HTTPException(
-            status_code=413,
-            detail=f"File size exceeds {MAX_FILE_SIZE // (1024*1024)}MB limit"
-        )
-
     # Validate file format
-    if not validate_audio_file(file):
+    is_valid, file_ext = validate_audio_file(file)
+    if not is_valid:
         raise HTTPException(
             status_code=400,
-            detail=f"Unsupported file format. Supported formats: {', '.join(SUPPORTED_FORMATS)}"
+            detail=f"Unsupported file format. Supported formats: {', '.join(sorted(SUPPORTED_FORMATS))}"
         )
 
+    if transcription_queue.full():
+        raise HTTPException(status_code=503, detail="Too many pending transcriptions, try again later")
+
     # Create task ID
     task_id = str(uuid.uuid4())
 
@@ -186,44 +371,56 @@ async def upload_file(
         task_id=task_id,
         status="pending",
         progress=0.0,
-        message="File uploaded, starting transcription...",
+        message="Uploading file...",
         created_at=datetime.now()
     )
-    active_tasks[task_id] = task_status
+    await task_store.create(task_status)
 
     try:
-        # Save uploaded file
-        file_path = await save_upload_file(file)
+        # Save uploaded file (size limit is enforced while streaming)
+        file_path = await save_upload_file(file, file_ext, MAX_FILE_SIZE)
 
-        # Start background processing
-        background_tasks.add_task(
-            process_transcription_task,
+        await task_store.update(
             task_id,
-            file_path,
-            request
+            status="queued",
+            message="File uploaded, waiting for a free transcription slot..."
         )
 
-        return JSONResponse({
+        # Hand the file over to the transcription workers
+        try:
+            transcription_queue.put_nowait((task_id, file_path, request))
+        except asyncio.QueueFull:
+            cleanup_file(file_path)
+            await task_store.delete(task_id)
+            raise HTTPException(status_code=503, detail="Too many pending transcriptions, try again later")
+
+        return ORJSONResponse({
             "success": True,
             "task_id": task_id,
             "message": "File uploaded successfully. Processing started."
         })
 
+    except HTTPException:
+        raise
+
+    except FileSizeError as e:
+        await task_store.delete(task_id)
+        raise HTTPException(status_code=413, detail=str(e))
+
     except Exception as e:
         # Clean up on error
-        if task_id in active_tasks:
-            del active_tasks[task_id]
+        await task_store.delete(task_id)
         raise HTTPException(status_code=500, detail=f"Failed to process file: {str(e)}")
 
 
 @app.get("/status/{task_id}")
 async def get_task_status(task_id: str):
     """Get transcription task status"""
-    if task_id not in active_tasks:
+    task = await task_store.get(task_id)
+    if task is None:
         raise HTTPException(status_code=404, detail="Task not found")
 
-    task = active_tasks[task_id]
-    return JSONResponse({
+    return ORJSONResponse({
         "task_id": task.task_id,
         "status": task.status,
         "progress": task.progress,
@@ -236,27 +433,25 @@ async def get_task_status(task_id: str):
 @app.get("/result/{task_id}")
 async def get_transcription_result(task_id: str, format: str = "json"):
     """Get transcription result"""
-    if task_id not in active_tasks:
+    task = await task_store.get(task_id)
+    if task is None:
         raise HTTPException(status_code=404, detail="Task not found")
 
-    task = active_tasks[task_id]
-
     if task.status != "completed":
         raise HTTPException(status_code=400, detail="Task not completed yet")
 
-    if task.result is None:
+    output_path = OUTPUT_DIR / f"{task_id}.{format}"
+    if not output_path.exists():
         raise HTTPException(status_code=404, detail="Result not available")
 
     # Return result in requested format
     if format == "json":
-        # Use mode='json' to properly serialize datetime objects
-        return JSONResponse(task.result.model_dump(mode='json'))
+        # The JSON export already holds the serialized result
+        async with aiofiles.open(output_path, 'rb') as f:
+            content = await f.read()
+        return Response(content, media_type="application/json")
     else:
         # Serve file for other formats
-        output_path = OUTPUT_DIR / f"{task_id}.{format}"
-        if not output_path.exists():
-            raise HTTPException(status_code=404, detail="Result file not found")
-
         return FileResponse(
             output_path,
             media_type="text/plain",
@@ -267,24 +462,17 @@ async def get_transcription_result(task_id: str, format: str = "json"):
 @app.get("/download/{task_id}")
 async def download_result(task_id: str, format: str = "txt"):
     """Download transcription result as file"""
-    if task_id not in active_tasks:
+    task = await task_store.get(task_id)
+    if task is None:
         raise HTTPException(status_code=404, detail="Task not found")
 
-    task = active_tasks[task_id]
-
     if task.status != "completed":
         raise HTTPException(status_code=400, detail="Task not completed yet")
 
-    # Check if file exists
+    # Outputs are published atomically, so an existing file is always complete
     output_path = OUTPUT_DIR / f"{task_id}.{format}"
     if not output_path.exists():
-        # Generate the file on-demand if it doesn't exist
-        if task.result:
-            formatted_output = transcriber.format_output(task.result, format)
-            async with aiofiles.open(output_path, 'w', encoding='utf-8') as f:
-                await f.write(formatted_output)
-        else:
-            raise HTTPException(status_code=404, detail="Result not available")
+        raise HTTPException(status_code=404, detail="Result not available")
 
     return FileResponse(
         output_path,
@@ -296,36 +484,34 @@ async def download_result(task_id: str, format: str = "txt"):
 @app.delete("/task/{task_id}")
 async def delete_task(task_id: str):
     """Delete task and associated files"""
-    if task_id not in active_tasks:
+    # Remove task from the store
+    if not await task_store.delete(task_id):
         raise HTTPException(status_code=404, detail="Task not found")
 
-    # Remove task from memory
-    del active_tasks[task_id]
-
     # Clean up associated files
     for format in ["json", "txt", "srt"]:
         output_path = OUTPUT_DIR / f"{task_id}.{format}"
         cleanup_file(str(output_path))
 
-    return JSONResponse({"success": True, "message": "Task deleted successfully"})
+    return ORJSONResponse({"success": True, "message": "Task deleted successfully"})
 
 
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
-    return JSONResponse({
+    return ORJSONResponse({
         "status": "healthy",
         "timestamp": datetime.now().isoformat(),
-        "active_tasks": len(active_tasks)
+        "active_tasks": await task_store.count()
     })
 
 
 @app.get("/models")
 async def get_available_models():
     """Get available transcription models"""
-    return JSONResponse({
+    return ORJSONResponse({
         "whisper_models": ["tiny", "base", "small", "medium"],
-        "current_model": "base",
+        "current_model": DEFAULT_MODEL_SIZE,
         "speaker_diarization": True
     })
 
@@ -336,13 +522,9 @@ async def cleanup_old_tasks():
     while True:
         try:
             await asyncio.sleep(3600)  # Run every hour
-            current_time = datetime.now()
+            cutoff = datetime.now().timestamp() - TASK_TTL
 
-            tasks_to_remove = []
-            for task_id, task in active_tasks.items():
-                # Remove tasks older than 24 hours
-                if (current_time - task.created_at).total_seconds() > 86400:
-                    tasks_to_remove.append(task_id)
+            tasks_to_remove = await task_store.expired(cutoff)
 
             for task_id in tasks_to_remove:
                 # Delete task and files
@@ -359,7 +541,26 @@ async def cleanup_old_tasks():
 @app.on_event("startup")
 async def startup_event():
     """Initialize background tasks"""
-    asyncio.create_task(cleanup_old_tasks())
+    global transcription_pool
+    transcription_pool = create_transcription_pool()
+
+    # Export the default model once so worker processes share its weights
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, export_shared_whisper_model, DEFAULT_MODEL_SIZE)
+
+    # One queue consumer per pool slot, so a task is only marked "processing"
+    # once a worker is free to run it; the rest stay "queued"
+    for _ in range(transcription_slots()):
+        background_workers.add(asyncio.create_task(transcription_worker()))
+
+    background_workers.add(asyncio.create_task(cleanup_old_tasks()))
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop transcription workers"""
+    if transcription_pool is not None:
+        transcription_pool.shutdown(wait=False)
 
 
 if __name__ == "__main__":
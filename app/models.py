@@ -32,7 +32,7 @@ class TranscriptionRequest(BaseModel):
 
 class TaskStatus(BaseModel):
     task_id: str
-    status: str  # pending, processing, completed, failed
+    status: str  # pending, queued, processing, completed, failed
     progress: float = 0.0
     message: Optional[str] = None
     result: Optional[TranscriptionResult] = None
@@ -0,0 +1,142 @@
+"""Task state storage backends
+
+Only lightweight task status lives here; transcription results are kept on
+disk under the output directory and loaded on demand.
+"""
+
+import heapq
+from typing import Dict, List, Optional, Tuple
+
+from app.models import TaskStatus
+
+try:
+    import redis.asyncio as aioredis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+
+# Fields persisted for each task (the full result is never stored)
+STATUS_FIELDS = ("task_id", "status", "progress", "message", "error", "created_at")
+
+
+class InMemoryTaskStore:
+    """Process-local task store, suitable for a single uvicorn worker"""
+
+    def __init__(self):
+        self._tasks: Dict[str, TaskStatus] = {}
+        # (creation timestamp, task_id) min-heap so expiry only touches expiring tasks
+        self._by_ctime: List[Tuple[float, str]] = []
+
+    async def create(self, task: TaskStatus):
+        self._tasks[task.task_id] = task
+        heapq.heappush(self._by_ctime, (task.created_at.timestamp(), task.task_id))
+
+    async def get(self, task_id: str) -> Optional[TaskStatus]:
+        return self._tasks.get(task_id)
+
+    async def update(self, task_id: str, **fields):
+        task = self._tasks.get(task_id)
+        if task is None:
+            return
+        for name, value in fields.items():
+            setattr(task, name, value)
+
+    async def delete(self, task_id: str) -> bool:
+        return self._tasks.pop(task_id, None) is not None
+
+    async def expired(self, cutoff: float) -> List[str]:
+        """Return ids of tasks created before the given timestamp"""
+        expired = []
+        while self._by_ctime and self._by_ctime[0][0] < cutoff:
+            _, task_id = heapq.heappop(self._by_ctime)
+            # Tasks deleted explicitly leave stale heap entries behind
+            if task_id in self._tasks:
+                expired.append(task_id)
+        return expired
+
+    async def count(self) -> int:
+        return len(self._tasks)
+
+
+class RedisTaskStore:
+    """Redis-backed task store shared by every worker process
+
+    Each task is a hash under ``task:{task_id}``; ``tasks:active`` tracks
+    membership and ``tasks:by_ctime`` orders tasks by creation time so that
+    expiry is a range query instead of a scan.
+    """
+
+    ACTIVE_KEY = "tasks:active"
+    CTIME_KEY = "tasks:by_ctime"
+
+    # ARGV: number of field/value pairs to set, the pairs, then fields to delete
+    UPDATE_SCRIPT = """
+    if redis.call('exists', KEYS[1]) == 0 then return 0 end
+    local n = tonumber(ARGV[1])
+    if n > 0 then redis.call('hset', KEYS[1], unpack(ARGV, 2, 1 + 2 * n)) end
+    if #ARGV > 1 + 2 * n then redis.call('hdel', KEYS[1], unpack(ARGV, 2 + 2 * n)) end
+    return 1
+    """
+
+    def __init__(self, url: str):
+        self.redis = aioredis.from_url(url, decode_responses=True)
+        self._update_script = self.redis.register_script(self.UPDATE_SCRIPT)
+
+    @staticmethod
+    def _key(task_id: str) -> str:
+        return f"task:{task_id}"
+
+    @staticmethod
+    def _serialize(fields: Dict) -> Dict[str, str]:
+        return {name: str(value) for name, value in fields.items() if value is not None}
+
+    async def create(self, task: TaskStatus):
+        fields = task.model_dump(mode='json', include=set(STATUS_FIELDS))
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(self._key(task.task_id), mapping=self._serialize(fields))
+            pipe.sadd(self.ACTIVE_KEY, task.task_id)
+            pipe.zadd(self.CTIME_KEY, {task.task_id: task.created_at.timestamp()})
+            await pipe.execute()
+
+    async def get(self, task_id: str) -> Optional[TaskStatus]:
+        fields = await self.redis.hgetall(self._key(task_id))
+        if not fields:
+            return None
+        return TaskStatus(**fields)
+
+    async def update(self, task_id: str, **fields):
+        # Existence check and write happen in one round trip, so a task
+        # deleted mid-transcription is never recreated as a partial hash
+        values = self._serialize(fields)
+        cleared = [name for name, value in fields.items() if value is None]
+        args = [len(values)]
+        for name, value in values.items():
+            args.extend((name, value))
+        args.extend(cleared)
+        await self._update_script(keys=[self._key(task_id)], args=args)
+
+    async def delete(self, task_id: str) -> bool:
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.delete(self._key(task_id))
+            pipe.srem(self.ACTIVE_KEY, task_id)
+            pipe.zrem(self.CTIME_KEY, task_id)
+            deleted, _, _ = await pipe.execute()
+        return bool(deleted)
+
+    async def expired(self, cutoff: float) -> List[str]:
+        """Return ids of tasks created before the given timestamp"""
+        return await self.redis.zrangebyscore(self.CTIME_KEY, 0, cutoff)
+
+    async def count(self) -> int:
+        return await self.redis.scard(self.ACTIVE_KEY)
+
+
+def create_task_store(redis_url: Optional[str] = None):
+    """Use Redis when configured and available, otherwise keep tasks in memory"""
+    if redis_url:
+        if REDIS_AVAILABLE:
+            print("Using Redis task store")
+            return RedisTaskStore(redis_url)
+        print("Warning: REDIS_URL is set but redis is not installed. Using in-memory task store.")
+    return InMemoryTaskStore()
@@ -1,40 +1,330 @@
 import os
 import uuid
+import contextlib
+import hashlib
+import bisect
+import dataclasses
+import functools
+import itertools
+import threading
 import subprocess
-import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Iterator, Tuple
 import whisper
 import torch
 import torchaudio
 import numpy as np
+import orjson
 from pathlib import Path
 
+try:
+    import av
+    AV_AVAILABLE = True
+except ImportError:
+    AV_AVAILABLE = False
+
+try:
+    from faster_whisper import WhisperModel
+    FASTER_WHISPER_AVAILABLE = True
+except ImportError:
+    FASTER_WHISPER_AVAILABLE = False
+
 try:
     from pyannote.audio import Pipeline
+    from scipy.optimize import linear_sum_assignment
     PYANNOTE_AVAILABLE = True
 except ImportError:
     PYANNOTE_AVAILABLE = False
     print("Warning: pyannote.audio not available. Speaker diarization will be disabled.")
 
 from app.models import TranscriptionResult, TranscriptionSegment, TaskStatus
+from app.batching import BatchingWhisperWorker
+
+# Whisper and pyannote both operate on 16kHz mono audio
+SAMPLE_RATE = 16000
+
+# Scale mapping 16-bit PCM samples to [-1, 1)
+PCM16_SCALE = np.float32(1.0 / 32768.0)
+
+# Label for segments that do not overlap any diarization turn
+UNKNOWN_SPEAKER = "Speaker Unknown"
+
+# With this many diarization turns or more, speaker matching switches from the
+# dense overlap matrix to a binary search over sorted turns
+DENSE_MATCH_MAX_TURNS = 256
+
+# Audio longer than one chunk is diarized in overlapping chunks so pyannote's
+# memory use stays bounded; speakers are linked across chunks by embedding
+DIARIZATION_CHUNK_S = int(os.environ.get("DIARIZATION_CHUNK_S", "600"))
+DIARIZATION_OVERLAP_S = 10
+# Short chunks leave pyannote too little context to cluster speakers reliably
+DIARIZATION_MIN_CHUNK_S = 60
+if DIARIZATION_CHUNK_S < DIARIZATION_MIN_CHUNK_S:
+    raise ValueError(
+        f"DIARIZATION_CHUNK_S must be at least {DIARIZATION_MIN_CHUNK_S} seconds "
+        f"(more than the {DIARIZATION_OVERLAP_S}s chunk overlap), got {DIARIZATION_CHUNK_S}"
+    )
+# Minimum cosine similarity for a chunk speaker to be linked to a known speaker
+SPEAKER_LINK_MIN_SIMILARITY = 0.6
+
+# Use the quantized CTranslate2 backend (faster-whisper) unless WHISPER_BACKEND=openai
+USE_FASTER_WHISPER = FASTER_WHISPER_AVAILABLE and os.environ.get("WHISPER_BACKEND", "faster-whisper") != "openai"
+
+# Batch Whisper encoder windows across concurrent files (openai-whisper on CUDA, WHISPER_BATCHING=1)
+WHISPER_BATCHING = os.environ.get("WHISPER_BATCHING") == "1" and not USE_FASTER_WHISPER
+
+# Skip silent regions with Silero VAD before running Whisper (disable with WHISPER_VAD=0)
+VAD_ENABLED = os.environ.get("WHISPER_VAD", "1") != "0"
+VAD_MIN_SILENCE_MS = 500
+# Pinned torch.hub ref, so the code that runs is a reviewed release and not the default branch
+SILERO_VAD_REPO = os.environ.get("SILERO_VAD_REPO", "snakers4/silero-vad:v5.1.2")
+
+# Directory holding Whisper weights shared between worker processes via mmap
+SHARED_MODEL_DIR = Path(os.environ.get("WHISPER_SHARED_DIR", "/dev/shm"))
+
+# Decoded 16kHz waveforms can be cached by content hash. Off by default since
+# uploads to the server are never seen twice; the CLI turns it on (AUDIO_CACHE=1 forces it)
+AUDIO_CACHE_ENABLED = os.environ.get("AUDIO_CACHE") == "1"
+AUDIO_CACHE_DIR = Path(os.environ.get("AUDIO_CACHE_DIR", Path.home() / ".cache" / "audiototext"))
+# Least recently used entries are evicted beyond this total size
+AUDIO_CACHE_MAX_BYTES = int(os.environ.get("AUDIO_CACHE_MAX_MB", "2048")) * 1024 * 1024
+# Bytes hashed at each end of the file to build the cache key
+AUDIO_CACHE_HASH_BYTES = 1 << 20
+
+
+def select_device() -> torch.device:
+    """Pick the best available accelerator: CUDA, then Apple MPS, then CPU"""
+    if torch.cuda.is_available():
+        return torch.device("cuda")
+    if torch.backends.mps.is_available():
+        return torch.device("mps")
+    return torch.device("cpu")
+
+
+# Number of model calls currently relying on cuDNN benchmarking, and the
+# benchmark setting to restore once the last of them finishes
+_cudnn_autotune_lock = threading.Lock()
+_cudnn_autotune_users = 0
+_cudnn_benchmark_saved = False
+
+
+@contextlib.contextmanager
+def cudnn_autotune():
+    """Let cuDNN benchmark conv algorithms while any fixed-shape model call runs
+
+    Whisper windows and pyannote chunks have fixed shapes, so the search runs
+    once per shape. It stays off elsewhere: the resampler sees a new input
+    length with every file and would search again each time. The flag is
+    process-wide, so overlapping stages share it through a reference count.
+    """
+    global _cudnn_autotune_users, _cudnn_benchmark_saved
+    with _cudnn_autotune_lock:
+        if _cudnn_autotune_users == 0:
+            _cudnn_benchmark_saved = torch.backends.cudnn.benchmark
+            torch.backends.cudnn.benchmark = True
+        _cudnn_autotune_users += 1
+    try:
+        yield
+    finally:
+        with _cudnn_autotune_lock:
+            _cudnn_autotune_users -= 1
+            if _cudnn_autotune_users == 0:
+                torch.backends.cudnn.benchmark = _cudnn_benchmark_saved
+
+
+def batching_enabled() -> bool:
+    """Return True when Whisper windows are batched across concurrent transcriptions"""
+    return WHISPER_BATCHING and torch.cuda.is_available()
+
+
+def shared_model_path(model_size: str) -> Path:
+    """Path of the shared Whisper checkpoint for a given model size"""
+    return SHARED_MODEL_DIR / f"whisper_{model_size}.pt"
+
+
+@functools.lru_cache(maxsize=None)
+def _resolve_hf_token() -> Optional[str]:
+    """Look up the HuggingFace token once: environment, then .env, then hf_token.txt"""
+    # 1. Try from environment variable
+    hf_token = os.environ.get('HF_TOKEN') or os.environ.get('HUGGINGFACE_TOKEN')
+
+    # 2. Try from .env file
+    if not hf_token:
+        env_file = Path('.env')
+        if env_file.exists():
+            with open(env_file, 'r') as f:
+                for line in f:
+                    line = line.strip()
+                    if line.startswith('HF_TOKEN=') or line.startswith('HUGGINGFACE_TOKEN='):
+                        hf_token = line.split('=', 1)[1].strip().strip('"').strip("'")
+                        break
+
+    # 3. Try from config file
+    if not hf_token:
+        config_file = Path('hf_token.txt')
+        if config_file.exists():
+            with open(config_file, 'r') as f:
+                hf_token = f.read().strip()
+
+    return hf_token or None
+
+
+def audio_cache_key(file_path: str) -> str:
+    """Hash the first and last megabyte plus the size, so large files are never read in full"""
+    size = os.path.getsize(file_path)
+    digest = hashlib.sha1(f"{size}:{SAMPLE_RATE}:mono".encode())
+    with open(file_path, "rb") as f:
+        digest.update(f.read(AUDIO_CACHE_HASH_BYTES))
+        if size > AUDIO_CACHE_HASH_BYTES:
+            f.seek(max(size - AUDIO_CACHE_HASH_BYTES, AUDIO_CACHE_HASH_BYTES))
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def export_shared_whisper_model(model_size: str = "base") -> Optional[Path]:
+    """Save Whisper weights once so worker processes can mmap them instead of reloading"""
+    if USE_FASTER_WHISPER:
+        # CTranslate2 loads its own converted weights; nothing to share
+        return None
+
+    path = shared_model_path(model_size)
+    if path.exists():
+        return path
+
+    try:
+        print(f"Exporting shared Whisper model: {model_size}")
+        model = whisper.load_model(model_size, device="cpu")
+        # Every uvicorn worker exports at startup; a per-process temp name keeps
+        # os.replace from publishing a file another worker is still writing
+        tmp_path = path.with_suffix(f".{uuid.uuid4().hex}.tmp")
+        try:
+            torch.save({
+                "dims": dataclasses.asdict(model.dims),
+                "model_state_dict": model.state_dict()
+            }, tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+        return path
+    except Exception as e:
+        print(f"Warning: Could not export shared Whisper model: {e}")
+        return None
 
 
 class AudioTranscriber:
-    def __init__(self):
+    def __init__(self, embedding_batch_size: int = 8, segmentation_batch_size: int = 8, low_vram: bool = False):
         self.whisper_models = {}
         self.pyannote_pipeline = None
-        self.supported_formats = ['.mp3', '.wav', '.m4a', '.flac', '.ogg', '.webm']
+        self.vad_model = None
+        # Set once loading the VAD model failed, so it is not fetched again on every file
+        self.vad_unavailable = False
+        self.batching_workers = {}
+        # One CUDA stream per pipeline stage, created on first use
+        self._streams = {}
+        self.device = select_device()
+        # openai-whisper keeps alignment_heads as a sparse buffer, which MPS cannot
+        # hold, so on Apple GPUs only pyannote and the resampler use the accelerator
+        self.whisper_device = torch.device("cpu") if self.device.type == "mps" else self.device
+        self._hf_token = _resolve_hf_token()
+        self.audio_cache = AUDIO_CACHE_ENABLED
+
+        # Keep only the running stage's model on the GPU (for cards with 8GB or less)
+        self.low_vram = low_vram
+
+        # pyannote defaults to batches of 32, which thrash or OOM on modest GPUs
+        self.embedding_batch_size = embedding_batch_size
+        self.segmentation_batch_size = segmentation_batch_size
+        self.supported_formats = frozenset({'.mp3', '.wav', '.m4a', '.flac', '.ogg', '.webm'})
+
+        # Models may be shared by several transcription threads
+        self._load_lock = threading.Lock()
+        self._pipeline_lock = threading.Lock()
+        self._vad_lock = threading.Lock()
+        self._diarize_lock = threading.Lock()
 
     def load_whisper_model(self, model_size: str = "base"):
         """Load Whisper model if not already loaded"""
-        if model_size not in self.whisper_models:
-            print(f"Loading Whisper model: {model_size}")
-            self.whisper_models[model_size] = whisper.load_model(model_size)
+        with self._load_lock:
+            if model_size not in self.whisper_models:
+                model = self._load_whisper_model(model_size)
+                self._warm_up_whisper(model)
+                self.whisper_models[model_size] = model
         return self.whisper_models[model_size]
 
+    def _warm_up_whisper(self, model):
+        """Run a second of silence through Whisper so CUDA init and kernel selection happen at load time"""
+        # Both Whisper backends only use the GPU on CUDA; CPU has no first-call lag worth paying for
+        if self.whisper_device.type != "cuda":
+            return
+
+        silence = np.zeros(SAMPLE_RATE, dtype=np.float32)
+        try:
+            if USE_FASTER_WHISPER:
+                segments, _ = model.transcribe(silence, beam_size=5)
+                list(segments)
+            else:
+                # Same cuDNN settings as real calls, so the algorithm search happens now
+                with torch.inference_mode(), cudnn_autotune():
+                    model.transcribe(silence, fp16=self.device.type == "cuda", verbose=None)
+        except Exception as e:
+            print(f"Warning: Whisper warm-up failed: {e}")
+
+    def _load_whisper_model(self, model_size: str):
+        """Load a Whisper model with the configured backend"""
+        shared_path = shared_model_path(model_size)
+        if USE_FASTER_WHISPER:
+            print(f"Loading faster-whisper model: {model_size}")
+            return self._load_faster_whisper_model(model_size)
+        if shared_path.exists():
+            print(f"Loading shared Whisper model: {model_size}")
+            return self._load_shared_whisper_model(shared_path)
+        print(f"Loading Whisper model: {model_size}")
+        return whisper.load_model(model_size, device=self.whisper_device)
+
+    def get_batching_worker(self, model_size: str = "base") -> BatchingWhisperWorker:
+        """Return the batching worker wrapping the given Whisper model"""
+        model = self.load_whisper_model(model_size)
+        with self._load_lock:
+            if model_size not in self.batching_workers:
+                self.batching_workers[model_size] = BatchingWhisperWorker(model)
+        return self.batching_workers[model_size]
+
+    def _load_faster_whisper_model(self, model_size: str):
+        """Load an int8-quantized CTranslate2 Whisper model"""
+        # CTranslate2 has no MPS backend, so Apple GPUs fall back to CPU
+        if self.device.type == "cuda":
+            # int8 weights with fp16 activations need Tensor cores (compute capability 7.0+)
+            has_tensor_cores = torch.cuda.get_device_capability()[0] >= 7
+            compute_type = "int8_float16" if has_tensor_cores else "int8"
+            return WhisperModel(model_size, device="cuda", compute_type=compute_type)
+        return WhisperModel(model_size, device="cpu", compute_type="int8")
+
+    def _load_shared_whisper_model(self, path: Path):
+        """Build a Whisper model whose weights are mmap'd from the shared checkpoint
+
+        On CPU the weight pages stay backed by the file, so every worker
+        process shares them through the kernel page cache.
+        """
+        checkpoint = torch.load(path, mmap=True, weights_only=True, map_location="cpu")
+        model = whisper.model.Whisper(whisper.model.ModelDimensions(**checkpoint["dims"]))
+        model.load_state_dict(checkpoint["model_state_dict"], assign=True)
+        return model.to(self.whisper_device)
+
     def load_pyannote_pipeline(self):
         """Load pyannote.audio pipeline for speaker diarization"""
+        with self._pipeline_lock:
+            pipeline = self._load_pyannote_pipeline()
+
+        # Batch sizes may have been changed after a background preload
+        if pipeline is not None and pipeline.embedding_batch_size != self.embedding_batch_size:
+            pipeline.embedding_batch_size = self.embedding_batch_size
+        if pipeline is not None and pipeline.segmentation_batch_size != self.segmentation_batch_size:
+            pipeline.segmentation_batch_size = self.segmentation_batch_size
+        return pipeline
+
+    def _load_pyannote_pipeline(self):
+        """Load the pipeline once; callers hold the pipeline lock"""
         if not PYANNOTE_AVAILABLE:
             print("pyannote.audio not available")
             return None
@@ -43,30 +333,7 @@ class AudioTranscriber:
             try:
                 print("Loading speaker diarization pipeline...")
 
-                # Try to load HuggingFace token from multiple sources
-                hf_token = None
-
-                # 1. Try from environment variable
-                hf_token = os.environ.get('HF_TOKEN') or os.environ.get('HUGGINGFACE_TOKEN')
-
-                # 2. Try from .env file
-                if not hf_token:
-                    env_file = Path('.env')
-                    if env_file.exists():
-                        with open(env_file, 'r') as f:
-                            for line in f:
-                                line = line.strip()
-                                if line.startswith('HF_TOKEN=') or line.startswith('HUGGINGFACE_TOKEN='):
-                                    hf_token = line.split('=', 1)[1].strip().strip('"').strip("'")
-                                    break
-
-                # 3. Try from config file
-                if not hf_token:
-                    config_file = Path('hf_token.txt')
-                    if config_file.exists():
-                        with open(config_file, 'r') as f:
-                            hf_token = f.read().strip()
-
+                hf_token = self._hf_token
                 if hf_token:
                     print(f"Using HuggingFace token (length: {len(hf_token)})")
                     # CORRECTED: Using 'token' instead of 'use_auth_token' for pyannote 3.1+
@@ -88,10 +355,13 @@ class AudioTranscriber:
                         "pyannote/speaker-diarization-3.1"
                     )
 
-                # Move to GPU if available
-                if torch.cuda.is_available():
-                    self.pyannote_pipeline.to(torch.device("cuda"))
-                print("Speaker diarization pipeline loaded successfully")
+                self.pyannote_pipeline.embedding_batch_size = self.embedding_batch_size
+                self.pyannote_pipeline.segmentation_batch_size = self.segmentation_batch_size
+
+                # Keep the pipeline on the accelerator for every subsequent call
+                self.pyannote_pipeline.to(self.device)
+                print(f"Speaker diarization pipeline loaded successfully on {self.device}")
+                self._warm_up_pipeline(self.pyannote_pipeline)
                 
             except Exception as e:
                 error_msg = str(e)
@@ -118,63 +388,280 @@ class AudioTranscriber:
                 return None
         return self.pyannote_pipeline
 
-    def preprocess_audio(self, file_path: str) -> str:
-        """Convert audio to 16kHz WAV format required by Whisper"""
+    def _warm_up_pipeline(self, pipeline):
+        """Run a second of silence through pyannote so the first real diarization skips kernel setup"""
+        if self.device.type == "cpu":
+            return
         try:
-            # Create temporary file for processed audio
-            temp_file = tempfile.NamedTemporaryFile(suffix='.wav', delete=False)
-            temp_path = temp_file.name
-            temp_file.close()
-
-            # Convert audio using ffmpeg
-            cmd = [
-                'ffmpeg', '-i', file_path,
-                '-ar', '16000',  # Sample rate
-                '-ac', '1',      # Mono
-                '-c:a', 'pcm_s16le',  # 16-bit PCM
-                '-y', temp_path
-            ]
+            with torch.inference_mode(), cudnn_autotune():
+                pipeline({"waveform": torch.zeros(1, SAMPLE_RATE), "sample_rate": SAMPLE_RATE})
+        except Exception as e:
+            print(f"Warning: Diarization warm-up failed: {e}")
 
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            if result.returncode != 0:
-                raise Exception(f"FFmpeg conversion failed: {result.stderr}")
+    def preprocess_audio(self, file_path: str) -> np.ndarray:
+        """Decode audio once into the 16kHz mono float32 array used by Whisper and pyannote"""
+        if not self.audio_cache:
+            return self._preprocess_audio(file_path)
 
-            return temp_path
+        cache_path = AUDIO_CACHE_DIR / f"{audio_cache_key(file_path)}.npy"
+        if cache_path.exists():
+            try:
+                audio = np.load(cache_path)
+                # Touch the entry so eviction drops the least recently used first
+                os.utime(cache_path)
+                return audio
+            except Exception as e:
+                print(f"Warning: Ignoring unreadable audio cache entry {cache_path.name}: {e}")
+
+        audio = self._preprocess_audio(file_path)
+        tmp_path = cache_path.with_suffix(f".{uuid.uuid4().hex}.tmp")
+        try:
+            AUDIO_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                np.save(f, audio)
+            os.replace(tmp_path, cache_path)
+            self._prune_audio_cache()
+        except Exception as e:
+            tmp_path.unlink(missing_ok=True)
+            print(f"Warning: Could not cache decoded audio: {e}")
+        return audio
+
+    def _prune_audio_cache(self):
+        """Delete least recently used cache entries until the cache fits AUDIO_CACHE_MAX_BYTES"""
+        entries = []
+        for path in AUDIO_CACHE_DIR.glob("*.npy"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= AUDIO_CACHE_MAX_BYTES:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+
+    def _preprocess_audio(self, file_path: str) -> np.ndarray:
+        """Decode and resample without consulting the cache"""
+        try:
+            try:
+                audio, sample_rate = self._decode_audio(file_path)
+            except Exception as e:
+                # Codecs the in-process decoders cannot handle go through ffmpeg
+                print(f"In-process decoding failed ({e}), falling back to ffmpeg")
+                return self._decode_with_ffmpeg(file_path)
+            return self._resample(audio, sample_rate)
         except Exception as e:
             raise Exception(f"Audio preprocessing failed: {str(e)}")
 
-    def transcribe_with_whisper(self, audio_path: str, model_size: str = "base", language: Optional[str] = None) -> Dict:
+    def _decode_audio(self, file_path: str) -> Tuple[np.ndarray, int]:
+        """Decode to mono float32 at the file's native sample rate, without spawning ffmpeg"""
+        if AV_AVAILABLE:
+            return self._decode_with_av(file_path)
+
+        waveform, sample_rate = torchaudio.load(file_path)
+        if waveform.shape[0] > 1:
+            waveform = waveform.mean(0, keepdim=True)
+        return waveform.squeeze(0).numpy(), sample_rate
+
+    def _decode_with_av(self, file_path: str) -> Tuple[np.ndarray, int]:
+        """Decode in-process with PyAV, downmixing to mono float samples"""
+        chunks = []
+
+        with av.open(file_path) as container:
+            stream = container.streams.audio[0]
+            sample_rate = stream.codec_context.sample_rate
+            # Resampling is left to _resample so it can run on the accelerator
+            resampler = av.AudioResampler(format="flt", layout="mono", rate=sample_rate)
+            for frame in container.decode(stream):
+                for resampled in resampler.resample(frame):
+                    chunks.append(resampled.to_ndarray().reshape(-1))
+
+        # Flush samples still buffered in the resampler
+        for resampled in resampler.resample(None):
+            chunks.append(resampled.to_ndarray().reshape(-1))
+
+        if not chunks:
+            return np.zeros(0, dtype=np.float32), sample_rate
+        return np.concatenate(chunks), sample_rate
+
+    def _decode_with_ffmpeg(self, file_path: str) -> np.ndarray:
+        """Decode to 16kHz mono through an ffmpeg pipe, without any temporary file"""
+        cmd = [
+            "ffmpeg", "-nostdin", "-i", file_path,
+            "-ar", str(SAMPLE_RATE), "-ac", "1",
+            "-f", "s16le", "-c:a", "pcm_s16le", "-"
+        ]
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=1 << 20)
+        raw, err = proc.communicate()
+        if proc.returncode != 0:
+            raise Exception(f"ffmpeg failed: {err.decode(errors='replace').strip()}")
+        # Cast and scale in a single pass instead of astype() followed by a multiply
+        return np.multiply(np.frombuffer(raw, np.int16), PCM16_SCALE, dtype=np.float32)
+
+    def _resample(self, audio: np.ndarray, sample_rate: int) -> np.ndarray:
+        """Resample mono audio to 16kHz on the transcriber's device"""
+        if sample_rate == SAMPLE_RATE:
+            return audio
+        waveform = torch.from_numpy(audio).to(self.device)
+        resampled = torchaudio.functional.resample(waveform, sample_rate, SAMPLE_RATE)
+        return resampled.cpu().numpy()
+
+    def transcribe_with_whisper(self, audio: np.ndarray, model_size: str = "base", language: Optional[str] = None) -> Dict:
         """Transcribe audio using Whisper"""
         model = self.load_whisper_model(model_size)
 
+        if USE_FASTER_WHISPER:
+            return self._transcribe_with_faster_whisper(model, audio, language)
+
         options = {
             "task": "transcribe",
-            "fp16": torch.cuda.is_available(),
+            "fp16": self.device.type == "cuda",
             "verbose": False
         }
 
         if language:
             options["language"] = language
 
+        # Only feed detected speech to Whisper so silent windows are not decoded
+        regions = self._detect_speech(audio) if VAD_ENABLED else None
+
         try:
-            result = model.transcribe(audio_path, **options)
+            if regions is None:
+                return self._run_whisper(model, model_size, audio, options)
+
+            if not regions:
+                print("No speech detected")
+                return {"text": "", "segments": [], "language": language}
+
+            speech = np.concatenate([audio[start:end] for start, end in regions])
+            result = self._run_whisper(model, model_size, speech, options)
+            self._restore_segment_times(result["segments"], regions)
             return result
         except Exception as e:
             raise Exception(f"Whisper transcription failed: {str(e)}")
 
-    def diarize_speakers(self, audio_path: str) -> Optional[List]:
-        """Perform speaker diarization using pyannote.audio"""
+    def _run_whisper(self, model, model_size: str, audio: np.ndarray, options: Dict) -> Dict:
+        """Run openai-whisper directly, or through the shared batching worker"""
+        if batching_enabled():
+            worker = self.get_batching_worker(model_size)
+            return worker.submit(audio, options.get("language")).result()
+        with torch.inference_mode(), self._side_stream("whisper"), cudnn_autotune():
+            return model.transcribe(audio, **options)
+
+    def _detect_speech(self, audio: np.ndarray) -> Optional[List[Tuple[int, int]]]:
+        """Return (start, end) sample ranges containing speech, or None if VAD is unavailable"""
+        if self.vad_unavailable:
+            return None
+
+        try:
+            # Silero VAD keeps internal state, so calls are serialized
+            with self._vad_lock:
+                if self.vad_model is None:
+                    try:
+                        model, utils = torch.hub.load(SILERO_VAD_REPO, "silero_vad", trust_repo=True)
+                    except Exception as e:
+                        self.vad_unavailable = True
+                        print(f"Warning: Could not load Silero VAD, transcribing full audio from now on: {e}")
+                        return None
+                    self.vad_model = (model, utils[0])
+                model, get_speech_timestamps = self.vad_model
+
+                timestamps = get_speech_timestamps(
+                    torch.from_numpy(audio), model,
+                    sampling_rate=SAMPLE_RATE,
+                    min_silence_duration_ms=VAD_MIN_SILENCE_MS
+                )
+            return [(ts["start"], ts["end"]) for ts in timestamps]
+        except Exception as e:
+            print(f"Warning: Voice activity detection failed, transcribing full audio: {e}")
+            return None
+
+    def _restore_segment_times(self, segments: List[Dict], regions: List[Tuple[int, int]]):
+        """Map segment times on the concatenated speech back to the original audio"""
+        # offsets[i] is where regions[i] begins inside the concatenated speech
+        offsets = list(itertools.accumulate((end - start for start, end in regions), initial=0))
+
+        def to_original(seconds: float, is_end: bool) -> float:
+            sample = seconds * SAMPLE_RATE
+            # A segment ending exactly on a region boundary belongs to the earlier region
+            find = bisect.bisect_left if is_end else bisect.bisect_right
+            i = min(max(find(offsets, sample) - 1, 0), len(regions) - 1)
+            start, end = regions[i]
+            return min(start + sample - offsets[i], end) / SAMPLE_RATE
+
+        for segment in segments:
+            segment["start"] = to_original(segment["start"], is_end=False)
+            segment["end"] = to_original(segment["end"], is_end=True)
+
+    def stream_with_whisper(self, audio: np.ndarray, model_size: str = "base",
+                            language: Optional[str] = None) -> Tuple[Iterator[Dict], Optional[str]]:
+        """Return Whisper segments lazily along with the detected language
+
+        faster-whisper decodes each segment as it is consumed; openai-whisper
+        has to decode the whole file before the first segment is available.
+        """
+        if USE_FASTER_WHISPER:
+            model = self.load_whisper_model(model_size)
+            return self._stream_with_faster_whisper(model, audio, language)
+
+        result = self.transcribe_with_whisper(audio, model_size, language)
+        return iter(result["segments"]), result.get("language")
+
+    def _stream_with_faster_whisper(self, model, audio: np.ndarray,
+                                    language: Optional[str] = None) -> Tuple[Iterator[Dict], Optional[str]]:
+        """Start faster-whisper decoding, yielding segments in the openai-whisper layout"""
+        try:
+            segments, info = model.transcribe(
+                audio,
+                language=language,
+                beam_size=5,
+                vad_filter=VAD_ENABLED,
+                vad_parameters=dict(min_silence_duration_ms=VAD_MIN_SILENCE_MS)
+            )
+        except Exception as e:
+            raise Exception(f"Whisper transcription failed: {str(e)}")
+
+        return (
+            {"text": segment.text, "start": segment.start, "end": segment.end}
+            for segment in segments
+        ), info.language
+
+    def _transcribe_with_faster_whisper(self, model, audio: np.ndarray, language: Optional[str] = None) -> Dict:
+        """Transcribe with faster-whisper and return the openai-whisper result layout"""
+        segments, detected_language = self._stream_with_faster_whisper(model, audio, language)
+        try:
+            return {"segments": list(segments), "language": detected_language}
+        except Exception as e:
+            raise Exception(f"Whisper transcription failed: {str(e)}")
+
+    def diarize_speakers(self, audio: np.ndarray) -> Tuple[Optional[List], int]:
+        """Perform speaker diarization using pyannote.audio, returning (segments, number of speakers)"""
         pipeline = self.load_pyannote_pipeline()
         if pipeline is None:
             print("Diarization pipeline not available, skipping...")
-            return None
+            return None, 0
 
         try:
-            print(f"Starting speaker diarization on {audio_path}")
+            print(f"Starting speaker diarization on {len(audio) / SAMPLE_RATE:.1f}s of audio")
 
-            # Perform diarization directly on the audio file
+            # Pass the decoded waveform directly so pyannote does not re-read the file
             print("Running diarization...")
-            diarization = pipeline(audio_path)
+            with self._diarize_lock, torch.inference_mode(), self._side_stream("diarization"), cudnn_autotune():
+                if len(audio) > (DIARIZATION_CHUNK_S + DIARIZATION_OVERLAP_S) * SAMPLE_RATE:
+                    turns = self._chunk_diarize(audio, SAMPLE_RATE)
+                else:
+                    diarization = pipeline({
+                        "waveform": torch.from_numpy(audio).unsqueeze(0),
+                        "sample_rate": SAMPLE_RATE
+                    })
+                    # The diarization object is an Annotation in pyannote 3.1+
+                    turns = [
+                        (turn.start, turn.end, speaker_label)
+                        for turn, _, speaker_label in diarization.itertracks(yield_label=True)
+                    ]
 
             # Convert to list of segments
             segments = []
@@ -183,34 +670,153 @@ class AudioTranscriber:
 
             print("Processing diarization results...")
 
-            # The diarization object is an Annotation in pyannote 3.1+
-            # Use itertracks to get segments with speaker labels
-            for turn, _, speaker_label in diarization.itertracks(yield_label=True):
+            for start, end, speaker_label in turns:
                 # Map speaker label to speaker number
                 if speaker_label not in speaker_map:
                     speaker_map[speaker_label] = speaker_counter
                     speaker_counter += 1
 
                 segments.append({
-                    "start": turn.start,
-                    "end": turn.end,
+                    "start": start,
+                    "end": end,
                     "speaker": f"Speaker {speaker_map[speaker_label]}"
                 })
 
             print(f"Diarization complete: found {len(speaker_map)} speakers in {len(segments)} segments")
-            return segments
+            return segments, len(speaker_map)
 
         except Exception as e:
             print(f"Speaker diarization failed: {str(e)}")
             import traceback
             traceback.print_exc()
-            return None
+            return None, 0
+
+    def _chunk_diarize(self, waveform: np.ndarray, sr: int, chunk_s: int = DIARIZATION_CHUNK_S,
+                       overlap_s: int = DIARIZATION_OVERLAP_S) -> List[Tuple[float, float, int]]:
+        """Diarize long audio in overlapping chunks, returning (start, end, speaker index) turns"""
+        if chunk_s <= overlap_s:
+            raise ValueError(f"Diarization chunk ({chunk_s}s) must be longer than its overlap ({overlap_s}s)")
+        chunk = chunk_s * sr
+        step = (chunk_s - overlap_s) * sr
+        centroids = []  # summed unit embeddings of every speaker seen so far
+        turns = []
+
+        for start in range(0, len(waveform), step):
+            end = min(start + chunk, len(waveform))
+            offset = start / sr
+            print(f"Diarizing chunk {offset:.0f}s-{end / sr:.0f}s")
+
+            diarization, embeddings = self.pyannote_pipeline({
+                "waveform": torch.from_numpy(waveform[start:end]).unsqueeze(0),
+                "sample_rate": sr
+            }, return_embeddings=True)
+
+            # embeddings[i] belongs to diarization.labels()[i]
+            links = self._link_chunk_speakers(embeddings, centroids)
+            speaker_index = dict(zip(diarization.labels(), links))
+
+            # Each chunk owns half of the overlap it shares with a neighbour
+            keep_from = offset + overlap_s / 2 if start > 0 else 0.0
+            keep_to = end / sr - overlap_s / 2 if end < len(waveform) else float("inf")
+            for turn, _, speaker_label in diarization.itertracks(yield_label=True):
+                turn_start = max(offset + turn.start, keep_from)
+                turn_end = min(offset + turn.end, keep_to)
+                if turn_end > turn_start:
+                    turns.append((turn_start, turn_end, speaker_index[speaker_label]))
+
+            if end == len(waveform):
+                break
+
+        turns.sort()
+        return turns
+
+    def _link_chunk_speakers(self, embeddings: np.ndarray, centroids: List[np.ndarray]) -> List[int]:
+        """Match chunk speakers to known speakers (Hungarian assignment on cosine similarity)"""
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        # pyannote returns NaN embeddings for speakers with too little speech;
+        # they become zero vectors that never match and start a new speaker
+        unit = np.nan_to_num(embeddings / np.maximum(norms, 1e-8))
+        links = [None] * len(unit)
+
+        if centroids and len(unit):
+            known = np.stack(centroids)
+            known /= np.maximum(np.linalg.norm(known, axis=1, keepdims=True), 1e-8)
+            similarity = unit @ known.T
+            for row, col in zip(*linear_sum_assignment(similarity, maximize=True)):
+                if similarity[row, col] >= SPEAKER_LINK_MIN_SIMILARITY:
+                    links[row] = int(col)
+                    centroids[col] = centroids[col] + unit[row]
+
+        for row, link in enumerate(links):
+            if link is None:
+                links[row] = len(centroids)
+                centroids.append(unit[row].copy())
+        return links
+
+    def _can_overlap_stages(self) -> bool:
+        """Whisper and pyannote overlap on CPU threads or on separate CUDA streams; MPS has a single queue"""
+        if self.low_vram:
+            # Both models would have to be resident at once
+            return False
+        return self.device.type in ("cpu", "cuda")
+
+    def _use_gpu_for(self, stage: str, model_size: str = "base"):
+        """In low-VRAM mode, move every model but the one of the upcoming stage off the GPU"""
+        if not self.low_vram or self.device.type != "cuda":
+            return
+
+        cpu = torch.device("cpu")
+        if stage == "diarization":
+            for model in self.whisper_models.values():
+                self._move_whisper_model(model, cpu)
+            torch.cuda.empty_cache()
+            # A pipeline that is not loaded yet is placed on the GPU when it loads
+            if self.pyannote_pipeline is not None:
+                self.pyannote_pipeline.to(self.device)
+        else:
+            if self.pyannote_pipeline is not None:
+                self.pyannote_pipeline.to(cpu)
+            torch.cuda.empty_cache()
+            if model_size in self.whisper_models:
+                self._move_whisper_model(self.whisper_models[model_size], self.whisper_device)
+
+    def _move_whisper_model(self, model, device: torch.device):
+        """Move a Whisper model between host and GPU memory"""
+        if not USE_FASTER_WHISPER:
+            model.to(device)
+        elif device.type == "cpu":
+            # CTranslate2 keeps the unloaded weights in host memory for a fast reload
+            if model.model.model_is_loaded:
+                model.model.unload_model(to_cpu=True)
+        elif not model.model.model_is_loaded:
+            model.model.load_model()
+
+    @contextlib.contextmanager
+    def _side_stream(self, stage: str):
+        """Issue the enclosed CUDA work on the stage's own stream so concurrent stages can interleave
+
+        Work left on the legacy default stream would serialize against every
+        other stream, so each stage gets its own. The stream is created once and
+        reused: the caching allocator only recycles blocks on the stream that
+        allocated them, so a fresh stream per call would keep reserving memory.
+        """
+        if self.device.type != "cuda":
+            yield
+            return
+
+        with self._load_lock:
+            if stage not in self._streams:
+                self._streams[stage] = torch.cuda.Stream()
+            stream = self._streams[stage]
+
+        with torch.cuda.stream(stream):
+            yield
+        stream.synchronize()
 
     def assign_speakers_to_segments(self, whisper_segments: List[Dict], speaker_segments: Optional[List]) -> List[TranscriptionSegment]:
         """Assign speaker labels to Whisper segments based on diarization"""
         if not speaker_segments:
             # No speaker diarization available
-            print("No speaker diarization data, assigning all to Speaker 1")
             return [
                 TranscriptionSegment(
                     text=segment["text"].strip(),
@@ -221,33 +827,168 @@ class AudioTranscriber:
                 for segment in whisper_segments
             ]
 
-        transcription_segments = []
-
-        for whisper_seg in whisper_segments:
-            # Find which speaker segment this whisper segment belongs to
-            assigned_speaker = "Speaker 1"
-            max_overlap = 0
-
-            for speaker_seg in speaker_segments:
-                # Calculate overlap
-                overlap_start = max(whisper_seg["start"], speaker_seg["start"])
-                overlap_end = min(whisper_seg["end"], speaker_seg["end"])
-                overlap_duration = max(0, overlap_end - overlap_start)
-
-                if overlap_duration > max_overlap:
-                    max_overlap = overlap_duration
-                    assigned_speaker = speaker_seg["speaker"]
-
-            transcription_segments.append(
-                TranscriptionSegment(
-                    text=whisper_seg["text"].strip(),
-                    start_time=whisper_seg["start"],
-                    end_time=whisper_seg["end"],
-                    speaker=assigned_speaker
-                )
+        if len(speaker_segments) < DENSE_MATCH_MAX_TURNS:
+            speakers = self._match_speakers_dense(whisper_segments, speaker_segments)
+        else:
+            speakers = self._match_speakers_sorted(whisper_segments, speaker_segments)
+
+        return [
+            TranscriptionSegment(
+                text=whisper_seg["text"].strip(),
+                start_time=whisper_seg["start"],
+                end_time=whisper_seg["end"],
+                speaker=speaker
             )
+            for whisper_seg, speaker in zip(whisper_segments, speakers)
+        ]
+
+    def _match_speakers_dense(self, whisper_segments: List[Dict], speaker_segments: List[Dict]) -> List[str]:
+        """Pick the speaker turn with maximal overlap using a full N x M overlap matrix"""
+        ws = np.array([seg["start"] for seg in whisper_segments], dtype=np.float32)
+        we = np.array([seg["end"] for seg in whisper_segments], dtype=np.float32)
+        ss = np.array([seg["start"] for seg in speaker_segments], dtype=np.float32)
+        se = np.array([seg["end"] for seg in speaker_segments], dtype=np.float32)
+
+        overlap = np.maximum(
+            0.0, np.minimum(we[:, None], se[None, :]) - np.maximum(ws[:, None], ss[None, :])
+        )
+        best = overlap.argmax(axis=1)
+        has_overlap = overlap[np.arange(len(whisper_segments)), best] > 0
+
+        return [
+            speaker_segments[j]["speaker"] if matched else UNKNOWN_SPEAKER
+            for j, matched in zip(best.tolist(), has_overlap.tolist())
+        ]
+
+    def _match_speakers_sorted(self, whisper_segments: List[Dict], speaker_segments: List[Dict]) -> List[str]:
+        """Pick the speaker turn with maximal overlap by binary search over sorted turns
+
+        Only turns starting before the segment ends and not all ending before it
+        starts are examined, so long recordings avoid the quadratic matrix.
+        """
+        ws = np.array([seg["start"] for seg in whisper_segments])
+        we = np.array([seg["end"] for seg in whisper_segments])
+        ss = np.array([seg["start"] for seg in speaker_segments])
+        se = np.array([seg["end"] for seg in speaker_segments])
+
+        order = np.argsort(ss, kind="stable")
+        ss, se = ss[order], se[order]
+        # reach[i] is the latest end among the first i + 1 turns; it is non-decreasing
+        reach = np.maximum.accumulate(se)
+
+        lo = np.searchsorted(reach, ws, side="right")
+        hi = np.searchsorted(ss, we, side="left")
+
+        speakers = []
+        for i in range(len(whisper_segments)):
+            assigned_speaker = UNKNOWN_SPEAKER
+            if lo[i] < hi[i]:
+                overlap = np.minimum(we[i], se[lo[i]:hi[i]]) - np.maximum(ws[i], ss[lo[i]:hi[i]])
+                k = int(overlap.argmax())
+                if overlap[k] > 0:
+                    assigned_speaker = speaker_segments[order[lo[i] + k]]["speaker"]
+            speakers.append(assigned_speaker)
+
+        return speakers
+
+    def transcribe_audio_stream(self, file_path: str, detect_speakers: bool = True, model_size: str = "base",
+                                language: Optional[str] = None, info: Optional[Dict] = None) -> Iterator[TranscriptionSegment]:
+        """Yield speaker-labelled segments as Whisper produces them
+
+        ``info`` is filled with the detected language, speaker count, duration
+        and segment count; read it once the generator is exhausted.
+        """
+        if info is None:
+            info = {}
+
+        # Validate file exists and is supported
+        if not os.path.exists(file_path):
+            raise Exception("Audio file not found")
+
+        file_ext = Path(file_path).suffix.lower()
+        if file_ext not in self.supported_formats:
+            raise Exception(f"Unsupported file format: {file_ext}")
+
+        print(f"\n{'='*60}")
+        print(f"Starting transcription for {os.path.basename(file_path)}")
+        print(f"Model: {model_size}, Detect speakers: {detect_speakers}")
+        print(f"{'='*60}\n")
+
+        # Decode audio once; the same array feeds Whisper and pyannote
+        print("Preprocessing audio...")
+        audio = self.preprocess_audio(file_path)
+
+        # Diarize speakers if requested. Both stages only read the decoded audio,
+        # so diarization can run in the background while Whisper segments stream.
+        run_diarization = detect_speakers and PYANNOTE_AVAILABLE
+        if detect_speakers and not PYANNOTE_AVAILABLE:
+            print("Speaker detection requested but pyannote not available")
+
+        speaker_segments = None
+        diarize_future = None
+        executor = None
+        if run_diarization and self._can_overlap_stages():
+            print("Starting Whisper transcription and speaker diarization in parallel...")
+            executor = ThreadPoolExecutor(max_workers=1)
+            diarize_future = executor.submit(self.diarize_speakers, audio)
+        elif run_diarization:
+            print("Starting speaker diarization...")
+            self._use_gpu_for("diarization")
+            speaker_segments, num_speakers = self.diarize_speakers(audio)
+            self._record_speakers(speaker_segments, num_speakers, run_diarization, info)
+        else:
+            self._record_speakers(None, 0, run_diarization, info)
 
-        return transcription_segments
+        try:
+            print("Starting Whisper transcription...")
+            self._use_gpu_for("whisper", model_size)
+            whisper_segments, info["language"] = self.stream_with_whisper(audio, model_size, language)
+
+            # Segments are held back only until speaker turns are known
+            pending = []
+            num_segments = 0
+            duration = 0
+            for whisper_segment in whisper_segments:
+                pending.append(whisper_segment)
+                if diarize_future is not None and diarize_future.done():
+                    speaker_segments, num_speakers = diarize_future.result()
+                    diarize_future = None
+                    self._record_speakers(speaker_segments, num_speakers, run_diarization, info)
+                if diarize_future is None:
+                    for segment in self.assign_speakers_to_segments(pending, speaker_segments):
+                        num_segments += 1
+                        duration = segment.end_time
+                        yield segment
+                    pending = []
+
+            if diarize_future is not None:
+                speaker_segments, num_speakers = diarize_future.result()
+                self._record_speakers(speaker_segments, num_speakers, run_diarization, info)
+            for segment in self.assign_speakers_to_segments(pending, speaker_segments):
+                num_segments += 1
+                duration = segment.end_time
+                yield segment
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        print(f"Whisper transcription complete: {num_segments} segments")
+        info["num_segments"] = num_segments
+        info["duration"] = duration
+
+    def _record_speakers(self, speaker_segments: Optional[List], num_speakers: int, run_diarization: bool, info: Dict):
+        """Store the speaker count and diarization status of a finished diarization in ``info``"""
+        info["num_speakers"] = 1
+        info["speaker_diarization"] = run_diarization and speaker_segments is not None
+        if not run_diarization:
+            return
+
+        if speaker_segments:
+            info["num_speakers"] = num_speakers
+            print(f"Detected {info['num_speakers']} speaker(s)")
+        else:
+            print("Speaker diarization failed or returned no results")
+            print("No speaker diarization data, assigning all to Speaker 1")
 
     def transcribe_audio(self, file_path: str, detect_speakers: bool = True, model_size: str = "base",
                         language: Optional[str] = None, task_id: Optional[str] = None) -> TranscriptionResult:
@@ -256,89 +997,40 @@ class AudioTranscriber:
             task_id = str(uuid.uuid4())
 
         try:
-            # Validate file exists and is supported
-            if not os.path.exists(file_path):
-                raise Exception("Audio file not found")
+            info = {}
+            transcription_segments = list(
+                self.transcribe_audio_stream(file_path, detect_speakers, model_size, language, info)
+            )
 
-            file_ext = Path(file_path).suffix.lower()
-            if file_ext not in self.supported_formats:
-                raise Exception(f"Unsupported file format: {file_ext}")
+            # Build full text
+            full_text = " ".join(seg.text for seg in transcription_segments)
+
+            # Create result
+            result = TranscriptionResult(
+                segments=transcription_segments,
+                full_text=full_text,
+                duration=info["duration"],
+                num_speakers=info["num_speakers"],
+                language=info["language"],
+                metadata={
+                    "model_size": model_size,
+                    "whisper_backend": "faster-whisper" if USE_FASTER_WHISPER else "openai-whisper",
+                    "original_file": os.path.basename(file_path),
+                    "file_format": Path(file_path).suffix.lower(),
+                    "speaker_diarization": info["speaker_diarization"]
+                },
+                task_id=task_id,
+                created_at=datetime.now()
+            )
 
             print(f"\n{'='*60}")
-            print(f"Starting transcription for {os.path.basename(file_path)}")
-            print(f"Model: {model_size}, Detect speakers: {detect_speakers}")
+            print("Transcription complete!")
+            print(f"Duration: {result.duration:.1f}s")
+            print(f"Speakers: {result.num_speakers}")
+            print(f"Segments: {len(transcription_segments)}")
             print(f"{'='*60}\n")
 
-            # Preprocess audio
-            print("Preprocessing audio...")
-            processed_audio_path = self.preprocess_audio(file_path)
-
-            try:
-                # Transcribe with Whisper
-                print("Starting Whisper transcription...")
-                whisper_result = self.transcribe_with_whisper(processed_audio_path, model_size, language)
-                print(f"Whisper transcription complete: {len(whisper_result['segments'])} segments")
-
-                # Get speaker diarization if requested
-                speaker_segments = None
-                num_speakers = 1
-
-                if detect_speakers and PYANNOTE_AVAILABLE:
-                    print("\nStarting speaker diarization...")
-                    speaker_segments = self.diarize_speakers(processed_audio_path)
-                    if speaker_segments:
-                        # Count unique speakers
-                        speakers = set(seg["speaker"] for seg in speaker_segments)
-                        num_speakers = len(speakers)
-                        print(f"Detected {num_speakers} speaker(s)")
-                    else:
-                        print("Speaker diarization failed or returned no results")
-                else:
-                    if detect_speakers:
-                        print("Speaker detection requested but pyannote not available")
-
-                # Create transcription segments with speaker labels
-                print("\nAssigning speakers to segments...")
-                transcription_segments = self.assign_speakers_to_segments(
-                    whisper_result["segments"], speaker_segments
-                )
-
-                # Build full text
-                full_text = " ".join([seg.text for seg in transcription_segments])
-
-                # Get audio duration
-                audio_duration = whisper_result.get("segments", [])[-1]["end"] if whisper_result.get("segments") else 0
-
-                # Create result
-                result = TranscriptionResult(
-                    segments=transcription_segments,
-                    full_text=full_text,
-                    duration=audio_duration,
-                    num_speakers=num_speakers,
-                    language=whisper_result.get("language"),
-                    metadata={
-                        "model_size": model_size,
-                        "original_file": os.path.basename(file_path),
-                        "file_format": file_ext,
-                        "speaker_diarization": detect_speakers and PYANNOTE_AVAILABLE and speaker_segments is not None
-                    },
-                    task_id=task_id,
-                    created_at=datetime.now()
-                )
-
-                print(f"\n{'='*60}")
-                print("Transcription complete!")
-                print(f"Duration: {audio_duration:.1f}s")
-                print(f"Speakers: {num_speakers}")
-                print(f"Segments: {len(transcription_segments)}")
-                print(f"{'='*60}\n")
-
-                return result
-
-            finally:
-                # Clean up temporary files
-                if os.path.exists(processed_audio_path):
-                    os.unlink(processed_audio_path)
+            return result
 
         except Exception as e:
             print(f"\nERROR during transcription: {str(e)}")
@@ -346,49 +1038,71 @@ class AudioTranscriber:
             traceback.print_exc()
             raise Exception(f"Transcription failed: {str(e)}")
 
+    def load_models(self, model_size: str = "base", detect_speakers: bool = True):
+        """Load models up front so their cost is paid once for a batch of files"""
+        self.load_whisper_model(model_size)
+        if detect_speakers and PYANNOTE_AVAILABLE:
+            self._use_gpu_for("diarization")
+            self.load_pyannote_pipeline()
+
     def format_output(self, result: TranscriptionResult, output_format: str = "json") -> str:
         """Format transcription result in different formats"""
+        return "".join(self.format_output_iter(result, output_format))
+
+    def format_output_iter(self, result: TranscriptionResult, output_format: str = "json") -> Iterator[str]:
+        """Yield the formatted transcription in chunks (one per segment for TXT/SRT)"""
         if output_format == "json":
-            return result.model_dump_json(indent=2)
-
-        elif output_format == "txt":
-            lines = []
-            for segment in result.segments:
-                timestamp = f"[{int(segment.start_time//60):02d}:{int(segment.start_time%60):02d}]"
-                speaker = f"{segment.speaker}:" if segment.speaker else ""
-                lines.append(f"{timestamp} {speaker} {segment.text}")
-            return "\n".join(lines)
-
-        elif output_format == "srt":
-            # SRT subtitle format
-            srt_lines = []
+            yield orjson.dumps(result.model_dump(mode='json'), option=orjson.OPT_INDENT_2).decode()
+
+        elif output_format in ("txt", "srt"):
             for i, segment in enumerate(result.segments, 1):
-                start_time = self._format_srt_time(segment.start_time)
-                end_time = self._format_srt_time(segment.end_time)
+                yield self.format_segment(segment, i, output_format)
 
-                srt_lines.append(str(i))
-                srt_lines.append(f"{start_time} --> {end_time}")
+        else:
+            raise ValueError(f"Unsupported output format: {output_format}")
 
-                if segment.speaker:
-                    srt_lines.append(f"{segment.speaker}: {segment.text}")
-                else:
-                    srt_lines.append(segment.text)
+    def format_segment(self, segment: TranscriptionSegment, index: int, output_format: str = "txt") -> str:
+        """Format the index-th segment (1-based) as a TXT line or SRT block, separator included"""
+        separator = "\n" if index > 1 else ""
+        if output_format == "txt":
+            return (
+                f"{separator}{self._format_txt_time(segment.start_time)} "
+                f"{segment.speaker + ':' if segment.speaker else ''} {segment.text}"
+            )
 
-                srt_lines.append("")  # Empty line between segments
+        if output_format == "srt":
+            # SRT subtitle format, one block per segment separated by an empty line
+            return (
+                f"{separator}{index}\n"
+                f"{self._format_srt_time(segment.start_time)} --> {self._format_srt_time(segment.end_time)}\n"
+                f"{segment.speaker + ': ' if segment.speaker else ''}{segment.text}\n"
+            )
 
-            return "\n".join(srt_lines)
+        raise ValueError(f"Unsupported streaming output format: {output_format}")
 
-        else:
-            raise ValueError(f"Unsupported output format: {output_format}")
+    def _format_txt_time(self, seconds: float) -> str:
+        """Convert seconds to the TXT timestamp format ([MM:SS])"""
+        minutes, secs = divmod(int(seconds), 60)
+        return f"[{minutes:02d}:{secs:02d}]"
 
     def _format_srt_time(self, seconds: float) -> str:
         """Convert seconds to SRT time format (HH:MM:SS,mmm)"""
-        hours = int(seconds // 3600)
-        minutes = int((seconds % 3600) // 60)
-        secs = int(seconds % 60)
-        millisecs = int((seconds % 1) * 1000)
+        # Work on integer milliseconds so no float arithmetic follows the one multiply
+        hours, millisecs = divmod(int(seconds * 1000), 3_600_000)
+        minutes, millisecs = divmod(millisecs, 60_000)
+        secs, millisecs = divmod(millisecs, 1000)
         return f"{hours:02d}:{minutes:02d}:{secs:02d},{millisecs:03d}"
 
 
 # Global transcriber instance
 transcriber = AudioTranscriber()
+
+
+def cuda_available() -> bool:
+    """Return True when a CUDA device can be used"""
+    return torch.cuda.is_available()
+
+
+def run_transcription(**kwargs) -> TranscriptionResult:
+    """Entry point for worker processes; each process keeps its own loaded models"""
+    return transcriber.transcribe_audio(**kwargs)
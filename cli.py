@@ -5,10 +5,14 @@ Convert audio files to text with speaker detection
 """
 
 import argparse
+import contextlib
 import sys
 import os
+import threading
 from pathlib import Path
 
+import torch
+
 # Add app directory to path
 sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
 
@@ -25,22 +29,31 @@ Examples:
   python cli.py transcribe audio.mp3 --speakers --output result.txt
   python cli.py transcribe audio.mp3 --model small --format json
   python cli.py transcribe audio.mp3 --language fr --speakers
+  python cli.py transcribe *.mp3 --format srt --output transcripts/
         """
     )
 
     subparsers = parser.add_subparsers(dest='command', help='Available commands')
 
     # Transcribe command
-    transcribe_parser = subparsers.add_parser('transcribe', help='Transcribe audio file')
-    transcribe_parser.add_argument('input_file', help='Input audio file path')
+    transcribe_parser = subparsers.add_parser('transcribe', help='Transcribe audio files')
+    transcribe_parser.add_argument('input_files', nargs='+',
+                                  help='Input audio file path(s), transcribed with a single model load')
     transcribe_parser.add_argument('--speakers', action='store_true',
                                   help='Enable speaker diarization')
     transcribe_parser.add_argument('--model', choices=['tiny', 'base', 'small', 'medium'],
                                   default='base', help='Whisper model size (default: base)')
     transcribe_parser.add_argument('--language', help='Language code (e.g., fr, en, es)')
-    transcribe_parser.add_argument('--output', '-o', help='Output file path')
+    transcribe_parser.add_argument('--output', '-o',
+                                  help='Output file path (output directory when several files are given)')
     transcribe_parser.add_argument('--format', choices=['json', 'txt', 'srt'],
                                   default='txt', help='Output format (default: txt)')
+    transcribe_parser.add_argument('--diar-batch-size', type=int, default=8,
+                                  help='Speaker diarization batch size (default: 8, lower it if GPU memory is short)')
+    transcribe_parser.add_argument('--no-cache', action='store_true',
+                                  help='Do not cache decoded audio in ~/.cache/audiototext')
+    transcribe_parser.add_argument('--low-vram', action='store_true',
+                                  help='Keep only one model on the GPU at a time (for GPUs with 8GB or less)')
     transcribe_parser.add_argument('--verbose', '-v', action='store_true',
                                   help='Show detailed progress')
 
@@ -66,11 +79,8 @@ Examples:
         show_version()
 
 
-def transcribe_file(args):
-    """Transcribe audio file"""
-    input_file = Path(args.input_file)
-
-    # Validate input file
+def validate_input_file(input_file):
+    """Exit with an error if the input file is missing or unsupported"""
     if not input_file.exists():
         print(f"❌ Erreur: Le fichier '{input_file}' n'existe pas", file=sys.stderr)
         sys.exit(1)
@@ -89,50 +99,93 @@ def transcribe_file(args):
     # Check file size (warn if very large)
     file_size_mb = input_file.stat().st_size / (1024 * 1024)
     if file_size_mb > 100:
-        print(f"⚠️  Attention: Le fichier est très volumineux ({file_size_mb:.1f}MB)")
+        print(f"⚠️  Attention: Le fichier '{input_file.name}' est très volumineux ({file_size_mb:.1f}MB)")
         print("   La transcription peut prendre du temps et utiliser beaucoup de mémoire.")
 
+
+def preload_models(args):
+    """Load the models requested on the command line in the background"""
+    try:
+        transcriber.load_models(args.model, args.speakers)
+    except Exception as e:
+        # load_models runs again in the foreground and reports the error there
+        print(f"⚠️  Préchargement des modèles échoué: {e}", file=sys.stderr)
+
+
+def transcribe_file(args):
+    """Transcribe one or more audio files"""
+    transcriber.embedding_batch_size = args.diar_batch_size
+    transcriber.segmentation_batch_size = args.diar_batch_size
+    transcriber.low_vram = args.low_vram
+    # Re-running a file (other model, other format) skips decoding
+    transcriber.audio_cache = not args.no_cache
+
+    # Opt-in: load the requested models while the input files are checked.
+    # load_models below waits on the same locks instead of loading twice.
+    if os.environ.get("AUDIOTOTEXT_PRELOAD") == "1":
+        threading.Thread(target=preload_models, args=(args,), daemon=True).start()
+
+    input_files = [Path(path) for path in args.input_files]
+    for input_file in input_files:
+        validate_input_file(input_file)
+
+    # With several inputs, --output names a directory receiving one file per input
+    batch = len(input_files) > 1
+    if batch and args.output:
+        # Outputs are named after the input stem; refuse to overwrite one with another
+        seen = {}
+        for input_file in input_files:
+            if input_file.stem in seen:
+                print(f"❌ Erreur: '{seen[input_file.stem]}' et '{input_file}' produiraient le même fichier "
+                      f"'{input_file.stem}.{args.format}' dans '{args.output}'", file=sys.stderr)
+                sys.exit(1)
+            seen[input_file.stem] = input_file
+        Path(args.output).mkdir(parents=True, exist_ok=True)
+
+    failures = 0
     try:
         if args.verbose:
-            print(f"🎵 Transcription du fichier: {input_file}")
+            print(f"🎵 Transcription de {len(input_files)} fichier(s): {', '.join(str(f) for f in input_files)}")
             print(f"📝 Modèle: {args.model}")
             print(f"👥 Détection d'interlocuteurs: {'Oui' if args.speakers else 'Non'}")
             print(f"🌐 Langue: {args.language if args.language else 'Auto-détection'}")
             print(f"📄 Format de sortie: {args.format}")
             print()
 
-        # Perform transcription
+        # Perform transcription; models are loaded once for the whole batch
         print("⏳ Début de la transcription...")
-        result = transcriber.transcribe_audio(
-            file_path=str(input_file),
-            detect_speakers=args.speakers,
-            model_size=args.model,
-            language=args.language
-        )
+        transcriber.load_models(args.model, args.speakers)
+
+        for input_file in input_files:
+            output_path = None
+            if args.output:
+                output_path = Path(args.output)
+                if batch:
+                    output_path = output_path / f"{input_file.stem}.{args.format}"
+            elif batch:
+                print(f"🎵 {input_file}")
+
+            try:
+                # Skip autograd bookkeeping for every torch op run on this thread
+                with torch.inference_mode():
+                    stats = transcribe_to_output(args, input_file, output_path)
+            except Exception as e:
+                failures += 1
+                print(f"❌ Erreur lors de la transcription de '{input_file}': {str(e)}", file=sys.stderr)
+                continue
 
-        # Format output
-        formatted_output = transcriber.format_output(result, args.format)
-
-        # Save to file or print to stdout
-        if args.output:
-            output_path = Path(args.output)
-            with open(output_path, 'w', encoding='utf-8') as f:
-                f.write(formatted_output)
-            print(f"✅ Transcription terminée!")
-            print(f"📁 Résultat sauvegardé dans: {output_path}")
-        else:
             print("✅ Transcription terminée!")
-            print("-" * 50)
-            print(formatted_output)
-
-        # Show statistics if verbose
-        if args.verbose:
-            print()
-            print("📊 Statistiques:")
-            print(f"   Durée: {format_duration(result.duration)}")
-            print(f"   Interlocuteurs: {result.num_speakers}")
-            print(f"   Langue détectée: {result.language or 'Non détectée'}")
-            print(f"   Segments: {len(result.segments)}")
+            if output_path:
+                print(f"📁 Résultat sauvegardé dans: {output_path}")
+
+            # Show statistics if verbose
+            if args.verbose:
+                print()
+                print("📊 Statistiques:")
+                print(f"   Durée: {format_duration(stats['duration'])}")
+                print(f"   Interlocuteurs: {stats['num_speakers']}")
+                print(f"   Langue détectée: {stats['language'] or 'Non détectée'}")
+                print(f"   Segments: {stats['num_segments']}")
 
     except KeyboardInterrupt:
         print("\n❌ Transcription interrompue par l'utilisateur", file=sys.stderr)
@@ -141,6 +194,58 @@ def transcribe_file(args):
         print(f"❌ Erreur lors de la transcription: {str(e)}", file=sys.stderr)
         sys.exit(1)
 
+    if failures:
+        print(f"❌ {failures}/{len(input_files)} fichier(s) en échec", file=sys.stderr)
+        sys.exit(1)
+
+
+def transcribe_to_output(args, input_file, output_path=None):
+    """Transcribe one file into output_path (stdout if None) and return its statistics"""
+    stats = {}
+    if args.format == 'json':
+        # JSON needs the complete result (full text, speaker count) before writing
+        result = transcriber.transcribe_audio(
+            file_path=str(input_file),
+            detect_speakers=args.speakers,
+            model_size=args.model,
+            language=args.language
+        )
+        chunks = transcriber.format_output_iter(result, args.format)
+        stats.update(duration=result.duration, num_speakers=result.num_speakers,
+                     language=result.language, num_segments=len(result.segments))
+    else:
+        # TXT/SRT lines are written as soon as Whisper emits each segment
+        segments = transcriber.transcribe_audio_stream(
+            file_path=str(input_file),
+            detect_speakers=args.speakers,
+            model_size=args.model,
+            language=args.language,
+            info=stats
+        )
+        chunks = (transcriber.format_segment(segment, i, args.format)
+                  for i, segment in enumerate(segments, 1))
+
+    # Save to file or print to stdout, one formatted chunk at a time
+    if output_path:
+        with open(output_path, 'w', encoding='utf-8') as f:
+            f.writelines(chunks)
+    else:
+        print("-" * 50)
+        write_stdout(chunks)
+    return stats
+
+
+def write_stdout(chunks):
+    """Print formatted chunks as they arrive, each ending with its own newline"""
+    out = sys.stdout
+    # The transcriber logs with print() while the chunks are produced; send
+    # those logs to stderr so they never land inside the transcript
+    with contextlib.redirect_stdout(sys.stderr):
+        for chunk in chunks:
+            # Chunks start with their separator; end each one with it instead
+            out.write((chunk[1:] if chunk.startswith("\n") else chunk) + "\n")
+            out.flush()
+
 
 def show_info(args):
     """Show system information"""